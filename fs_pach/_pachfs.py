@@ -1,28 +1,41 @@
-from __future__ import absolute_import, print_function, unicode_literals
-
 __all__ = ["PACHFS"]
 
+import collections
 import contextlib
+import functools
 import io
+import itertools
+import logging
 import os
-import shutil
+import queue
 import tempfile
 import threading
-from os.path import exists, expanduser
+from concurrent.futures import ThreadPoolExecutor
 from ssl import SSLError
 
-import six
 from fs import ResourceType, errors
 from fs.base import FS
 from fs.info import Info
 from fs.mode import Mode
-from fs.path import basename, dirname, forcedir, join, normpath, relpath
+from fs.path import (
+    abspath,
+    basename,
+    combine,
+    dirname,
+    forcedir,
+    join,
+    normpath,
+    relpath,
+)
 from fs.subfs import SubFS
 from fs.time import datetime_to_epoch
+from fs.walk import Walker
+from grpc import Call, StatusCode
 from pachyderm_sdk import Client
 from pachyderm_sdk.api import pfs
 from pachyderm_sdk.errors import RpcError
-from six import text_type
+
+log = logging.getLogger(__name__)
 
 
 def _make_repr(class_name, *args, **kwargs):
@@ -52,26 +65,94 @@ def _make_repr(class_name, *args, **kwargs):
     return "{}({})".format(class_name, ", ".join(arguments))
 
 
+_BUFFER_SIZE = 1 << 20
+_RANGE_SIZE = 8 << 20
+_RANGE_WORKERS = 4
+_PARALLEL_READ_SIZE = 16 << 20
+_INVALID_PATH_CHARS = "\0"
+# Marks a directory, as Pachyderm has no empty directories.
+_EMPTY_SUFFIX = "/.empty"
+_DIR_TYPE = int(ResourceType.directory)
+_FILE_TYPE = int(ResourceType.file)
+
+# gRPC channels are thread-safe, so clients are shared across threads.
+_CLIENT_CACHE = {}
+_CLIENT_LOCK = threading.Lock()
+
+_GRPC_ERRORS = {
+    StatusCode.NOT_FOUND: errors.ResourceNotFound,
+    StatusCode.PERMISSION_DENIED: errors.PermissionDenied,
+    StatusCode.UNAUTHENTICATED: errors.PermissionDenied,
+    StatusCode.UNAVAILABLE: errors.RemoteConnectionError,
+}
+
+
+def _has_config():
+    """Check for a pachctl config file."""
+    return os.path.isfile(os.path.expanduser("~/.pachyderm/config.json"))
+
+
+_HAS_CONFIG = _has_config()
+
+
+def _iter_bytes(stream):
+    """Unwrap the chunks of a ``get_file`` byte stream."""
+    return (message.value for message in stream)
+
+
+@functools.lru_cache(maxsize=8192)
+def _validate_path(path):
+    """Normalize a path to an absolute path, as `FS.validatepath` does."""
+    if _INVALID_PATH_CHARS in path:
+        raise errors.InvalidCharsInPath(path)
+    return abspath(normpath(path))
+
+
+@functools.lru_cache(maxsize=8192)
+def _path_to_key(prefix_slash, delimiter, path):
+    """Converts a validated fs path to a pach repo key.
+
+    ``prefix_slash`` is the root prefix with a trailing slash (or empty),
+    and ``delimiter`` is None when it is a forward slash.
+    """
+    _key = prefix_slash + path.lstrip("/")
+    if delimiter is not None:
+        _key = _key.replace("/", delimiter)
+    return _key
+
+
+@functools.lru_cache(maxsize=8192)
+def _path_to_dir_key(prefix_slash, delimiter, path):
+    """Converts a validated fs path to a pach repo directory key."""
+    _key = forcedir(prefix_slash + path.lstrip("/")).lstrip("/")
+    if delimiter is not None:
+        _key = _key.replace("/", delimiter)
+    return _key
+
+
 class PachFile(io.IOBase):
     """Proxy for a Pachyderm file. (pfs.File)"""
 
     @classmethod
     def factory(cls, filename, mode, on_close):
         """Create a PachFile backed with a temporary file."""
-        _temp_file = tempfile.TemporaryFile()
+        _temp_file = tempfile.TemporaryFile(buffering=_BUFFER_SIZE)
         proxy = cls(_temp_file, filename, mode, on_close=on_close)
         return proxy
 
     def __repr__(self):
-        return _make_repr(
-            self.__class__.__name__, self.__filename, text_type(self.__mode)
-        )
+        return _make_repr(self.__class__.__name__, self.__filename, str(self.__mode))
 
     def __init__(self, f, filename, mode, on_close=None):
         self._f = f
         self.__filename = filename
         self.__mode = mode
         self._on_close = on_close
+        self._closed = False
+
+    def _check_closed(self):
+        if self._closed:
+            raise ValueError("I/O operation on closed file")
 
     def __enter__(self):
         return self
@@ -84,12 +165,15 @@ class PachFile(io.IOBase):
         return self._f
 
     def close(self):
+        # Mark the file closed before a batched upload starts reading it.
+        self._closed = True
         if self._on_close is not None:
-            self._on_close(self)
+            on_close, self._on_close = self._on_close, None
+            on_close(self)
 
     @property
     def closed(self):
-        return self._f.closed
+        return self._closed
 
     def fileno(self):
         return self._f.fileno()
@@ -104,22 +188,15 @@ class PachFile(io.IOBase):
         return self.__mode.reading
 
     def readline(self, limit=-1):
+        self._check_closed()
         return self._f.readline(limit)
 
     def readlines(self, hint=-1):
-        if hint == -1:
-            return self._f.readlines(hint)
-        else:
-            size = 0
-            lines = []
-            for line in iter(self._f.readline, b""):
-                lines.append(line)
-                size += len(line)
-                if size > hint:
-                    break
-            return lines
+        self._check_closed()
+        return self._f.readlines(hint)
 
     def seek(self, offset, whence=os.SEEK_SET):
+        self._check_closed()
         if whence not in (os.SEEK_CUR, os.SEEK_END, os.SEEK_SET):
             raise ValueError("invalid value for 'whence'")
         self._f.seek(offset, whence)
@@ -129,62 +206,270 @@ class PachFile(io.IOBase):
         return True
 
     def tell(self):
+        self._check_closed()
         return self._f.tell()
 
     def writable(self):
         return self.__mode.writing
 
     def writelines(self, lines):
+        self._check_closed()
         return self._f.writelines(lines)
 
     def read(self, n=-1):
+        self._check_closed()
         if not self.__mode.reading:
             raise IOError("not open for reading")
         return self._f.read(n)
 
     def readall(self):
-        return self._f.readall()
+        self._check_closed()
+        return self._f.read()
 
     def readinto(self, b):
-        return self._f.readinto()
+        self._check_closed()
+        return self._f.readinto(b)
 
     def write(self, b):
+        self._check_closed()
         if not self.__mode.writing:
             raise IOError("not open for reading")
         self._f.write(b)
         return len(b)
 
     def truncate(self, size=None):
+        self._check_closed()
         if size is None:
             size = self._f.tell()
         self._f.truncate(size)
         return size
 
 
-@contextlib.contextmanager
-def pacherrors(path):
+class _LazyPachReader(io.RawIOBase):
+    """
+    Read-only stream that pulls a Pachyderm file as it is read.
+
+    ``open_stream`` is called to start a ``get_file`` byte stream of
+    the file, which is ``size`` bytes long; it should be pinned to a
+    commit so that every stream sees the same contents. Seeking forward
+    skips data in the stream; any other seek downloads the whole file
+    to a temporary file and serves reads from there.
+
+    """
+
+    def __init__(self, path, open_stream, size):
+        self._path = path
+        self._open_stream = open_stream
+        self._size = size
+        self._stream = self._spill = None
+        self._buffer = bytearray()
+        self._pos = 0
+        self._stream = open_stream()
+        # Start the stream now, so a missing file raises on open.
+        with pacherrors(path):
+            self._fill(1)
+
+    def _fill(self, size):
+        """Pull chunks from the stream until ``size`` bytes are buffered."""
+        for message in self._stream:
+            self._buffer.extend(message.value)
+            if len(self._buffer) >= size:
+                break
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        if self._spill is not None:
+            return self._spill.readinto(b)
+        size = len(b)
+        if len(self._buffer) < size:
+            with pacherrors(self._path):
+                self._fill(size)
+        n = min(size, len(self._buffer))
+        memoryview(b).cast("B")[:n] = self._buffer[:n]
+        del self._buffer[:n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if self._spill is None:
+            if whence == os.SEEK_CUR:
+                offset, whence = self._pos + offset, os.SEEK_SET
+            elif whence == os.SEEK_END:
+                offset, whence = self._size + offset, os.SEEK_SET
+            if whence == os.SEEK_SET and offset >= self._pos:
+                skip = bytearray(min(offset - self._pos, _BUFFER_SIZE))
+                while self._pos < offset and self.readinto(skip):
+                    skip = skip[: offset - self._pos]
+                return self._pos
+            self._spill = tempfile.TemporaryFile(buffering=_BUFFER_SIZE)
+            with pacherrors(self._path):
+                self._spill.writelines(_iter_bytes(self._open_stream()))
+            self._stream.close()
+            self._stream = self._buffer = None
+            self._spill.seek(self._pos)
+        return self._spill.seek(offset, whence)
+
+    def tell(self):
+        if self._spill is not None:
+            return self._spill.tell()
+        return self._pos
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = self._buffer = None
+        if self._spill is not None:
+            self._spill.close()
+        super(_LazyPachReader, self).close()
+
+
+def _prep(fn):
+    """Validate a method's path and pass it on along with its repo key.
+
+    The decorated method is called as ``fn(self, path, _path, _key, ...)``
+    where ``_path`` is the validated path and ``_key`` its file key.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(self, path, *args, **kwargs):
+        _path = self.validatepath(path)
+        _key = self._path_to_key(_path)
+        return fn(self, path, _path, _key, *args, **kwargs)
+
+    return wrapper
+
+
+class _UploadRing(object):
+    """
+    A background thread that runs queued writes in submission order.
+
+    `submit` blocks only when the queue is full. `join` waits for the
+    queued writes to finish and raises the first error one of them hit.
+
+    """
+
+    def __init__(self, maxsize=64):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            fn = self._queue.get()
+            try:
+                if fn is None:
+                    return
+                fn()
+            except Exception as error:
+                if self._error is None:
+                    self._error = error
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn):
+        self._queue.put(fn)
+
+    def join(self):
+        self._queue.join()
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self, raise_error=True):
+        """Stop the thread once the queue drains.
+
+        If ``raise_error`` is False, an upload error is logged rather
+        than raised, so it doesn't replace an exception in flight.
+        """
+        self._queue.put(None)
+        try:
+            self.join()
+        except Exception:
+            if raise_error:
+                raise
+            log.exception("queued upload failed")
+
+
+class pacherrors(object):
     """Translate Pachyderm errors to FSErrors."""
-    try:
-        yield
-    except RpcError as error:
-        _error = error.response.get("Error", {})
-        error_code = _error.get("Code", None)
-        response_meta = error.response.get("ResponseMetadata", {})
-        http_status = response_meta.get("HTTPStatusCode", 200)
-        error_msg = _error.get("Message", None)
-        if error_code == "NoSuchBucket":
-            raise errors.ResourceError(path, exc=error, msg=error_msg)
-        if http_status == 404:
-            raise errors.ResourceNotFound(path)
-        elif http_status == 403:
-            raise errors.PermissionDenied(path=path, msg=error_msg)
-        else:
-            raise errors.OperationFailed(path=path, exc=error)
-    except Exception as error:
-        raise errors.RemoteConnectionError(path, exc=error, msg="{}".format(error))
+
+    __slots__ = ("_path",)
+
+    def __init__(self, path):
+        self._path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None or not issubclass(exc_type, Exception):
+            return False
+        if issubclass(exc_type, errors.FSError):
+            return False
+        path = self._path
+        if issubclass(exc_type, RpcError):
+            if isinstance(exc_value, Call):
+                error_cls = _GRPC_ERRORS.get(exc_value.code(), errors.OperationFailed)
+                error_msg = exc_value.details()
+            else:
+                error_cls, error_msg = errors.OperationFailed, None
+            if error_cls is errors.ResourceNotFound:
+                raise errors.ResourceNotFound(path)
+            raise error_cls(path=path, exc=exc_value, msg=error_msg)
+        raise errors.RemoteConnectionError(
+            path, exc=exc_value, msg="{}".format(exc_value)
+        )
+
+
+class PachWalker(Walker):
+    """
+    A Walker that prefetches sub-directory listings.
+
+    While the caller consumes a directory, the listings of the
+    sub-directories it contains are fetched on the filesystem's thread
+    pool, so the walk isn't bound by one list_file round-trip at a time.
+    Results are still yielded in the usual walk order.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PachWalker, self).__init__(*args, **kwargs)
+        self._listings = {}
+
+    def _scan(self, fs, dir_path, namespaces=None):
+        if not isinstance(fs, PACHFS):
+            for info in super(PachWalker, self)._scan(fs, dir_path, namespaces):
+                yield info
+            return
+        future = self._listings.pop(dir_path, None)
+        try:
+            if future is None:
+                infos = list(fs.scandir(dir_path, namespaces=namespaces))
+            else:
+                infos = future.result()
+        except errors.FSError as error:
+            if not self.on_error(dir_path, error):
+                raise
+            return
+        if self.max_depth is None:
+            for info in infos:
+                if (
+                    info.is_dir
+                    and self._check_open_dir(fs, dir_path, info)
+                    and self.check_scan_dir(fs, dir_path, info)
+                ):
+                    _path = combine(dir_path, info.name)
+                    self._listings[_path] = fs._list_async(_path, namespaces)
+        for info in infos:
+            yield info
 
 
-@six.python_2_unicode_compatible
 class PACHFS(FS):
     """
     Construct an Pachyderm filesystem for
@@ -205,7 +490,7 @@ class PACHFS(FS):
 
     _meta = {
         "case_insensitive": False,
-        "invalid_path_chars": "\0",
+        "invalid_path_chars": _INVALID_PATH_CHARS,
         "network": True,
         "read_only": False,
         "thread_safe": True,
@@ -213,6 +498,8 @@ class PACHFS(FS):
         "virtual": False,
     }
 
+    walker_class = PachWalker
+
     _object_attributes = [
         "accept_ranges",
         "cache_control",
@@ -252,9 +539,7 @@ class PACHFS(FS):
         branch="master",
         delimiter="/",
     ):
-        self.has_config = False
-        if exists(expanduser("~/.pachyderm/config.json")):
-            self.has_config = True
+        self.has_config = _HAS_CONFIG
         self._repo_name = repo_name
         self.dir_path = dir_path
         self._prefix = relpath(normpath(dir_path)).rstrip("/")
@@ -264,9 +549,21 @@ class PACHFS(FS):
         self.branch = branch
         self.project_name = project_name
         self.delimiter = delimiter
+        self._prefix_slash = (self._prefix + "/") if self._prefix else ""
+        self._swap_delimiter = delimiter if delimiter != "/" else None
+        self._uri_prefix = f"{project_name}/{repo_name}@{branch}"
+        self._branch_uri = pfs.Branch.from_uri(self._uri_prefix)
+        self._file_uri = functools.lru_cache(maxsize=4096)(self._make_file_uri)
         self._tlocal = threading.local()
+        self._pool = None
         super(PACHFS, self).__init__()
 
+    def refresh_config(self):
+        """Re-check for a pachctl config file, e.g. after one is created."""
+        global _HAS_CONFIG
+        _HAS_CONFIG = self.has_config = _has_config()
+        return self.has_config
+
     def __repr__(self):
         return _make_repr(
             self.__class__.__name__,
@@ -278,216 +575,290 @@ class PACHFS(FS):
     def __str__(self):
         return "<PACHFS '{}'>".format(join(self._repo_name, relpath(self.dir_path)))
 
+    def validatepath(self, path):
+        self.check()
+        if isinstance(path, bytes):
+            raise TypeError("paths must be str (not bytes)")
+        return _validate_path(path)
+
     def _path_to_key(self, path):
-        """Converts an fs path to a pach repo key."""
-        _path = relpath(normpath(path))
-        _key = (
-            "{}/{}".format(self._prefix, _path).lstrip("/").replace("/", self.delimiter)
-        )
-        return _key
+        """Converts a validated fs path to a pach repo key."""
+        return _path_to_key(self._prefix_slash, self._swap_delimiter, path)
 
     def _path_to_dir_key(self, path):
-        """Converts an fs path to a pach repo key."""
-        _path = relpath(normpath(path))
-        _key = (
-            forcedir("{}/{}".format(self._prefix, _path))
-            .lstrip("/")
-            .replace("/", self.delimiter)
-        )
-        return _key
+        """Converts a validated fs path to a pach repo directory key."""
+        return _path_to_dir_key(self._prefix_slash, self._swap_delimiter, path)
+
+    def _make_file_uri(self, key):
+        """Build the pfs.File for a pach repo key (cached as ``_file_uri``)."""
+        return pfs.File.from_uri(f"{self._uri_prefix}:{key}")
 
     def _key_to_path(self, key):
         return key.replace(self.delimiter, "/")
 
     def _get_object(self, path, key):
+        self.flush()
         _key = key.rstrip(self.delimiter)
         try:
             with pacherrors(path):
-                file_obj = pfs.File.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}:{_key}"
-                )
-                obj = self.client.pfs.list_file(file=file_obj)
+                return [self.client.pfs.inspect_file(file=self._file_uri(_key))]
         except errors.ResourceNotFound:
             with pacherrors(path):
-                file_obj = pfs.File.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}:{_key+self.delimiter}"
-                )
+                file_obj = self._file_uri(_key + self.delimiter)
                 obj = self.client.pfs.list_file(file=file_obj)
-                return obj
-        else:
-            return obj
+                first = next(obj, None)
+            if first is None:
+                raise errors.ResourceNotFound(path)
+            return itertools.chain([first], obj)
 
     @property
     def client(self):
-        if not hasattr(self._tlocal, "client"):
-            if self.has_config:
-                self._tlocal.client = Client.from_config()
-            else:
-                self._tlocal.client = Client(
-                    host=self.host, port=self.port, auth_token=self.auth_token
-                )
-        return self._tlocal.client
+        """The Pachyderm client, shared by every thread and PACHFS instance."""
+        key = (self.host, self.port, self.auth_token, self.has_config)
+        client = _CLIENT_CACHE.get(key)
+        if client is None:
+            with _CLIENT_LOCK:
+                client = _CLIENT_CACHE.get(key)
+                if client is None:
+                    if self.has_config:
+                        client = Client.from_config()
+                    else:
+                        client = Client(
+                            host=self.host, port=self.port, auth_token=self.auth_token
+                        )
+                    _CLIENT_CACHE[key] = client
+        return client
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Group every write made in this thread into a single commit.
+
+        Pachyderm commits are expensive, so bulk operations (such as
+        ``fs.copy.copy_fs``) should be wrapped in a batch::
+
+            with pachfs.batch():
+                copy_fs(src_fs, pachfs)
+
+        Nested batches reuse the outer commit.
+
+        Inside a batch, closing a written file and `writebytes` queue
+        their uploads on a background thread and return immediately.
+        Other writes, and every read, first wait for the queued uploads,
+        as does `flush`. The batch flushes before it finishes the commit.
+
+        """
+        commit = getattr(self._tlocal, "commit", None)
+        if commit is not None:
+            yield commit
+            return
+        with self.client.pfs.commit(branch=self._branch_uri) as c:
+            self._tlocal.commit = c
+            self._tlocal.ring = ring = _UploadRing()
+            failed = True
+            try:
+                yield c
+                failed = False
+            finally:
+                self._tlocal.commit = self._tlocal.ring = None
+                ring.close(raise_error=not failed)
+
+    def flush(self):
+        """Wait for the writes queued by the current batch, if any."""
+        ring = getattr(self._tlocal, "ring", None)
+        if ring is not None:
+            ring.join()
+
+    def _with_commit(self, fn):
+        """Call ``fn`` with the active batch commit, or a one-shot commit."""
+        commit = getattr(self._tlocal, "commit", None)
+        if commit is not None:
+            self.flush()
+            return fn(commit)
+        with self.client.pfs.commit(branch=self._branch_uri) as c:
+            return fn(c)
+
+    def _submit(self, path, fn):
+        """Queue ``fn`` on the active batch, or call it with a one-shot commit."""
+        ring = getattr(self._tlocal, "ring", None)
+        if ring is None:
+            with pacherrors(path):
+                self._with_commit(fn)
+            return
+        commit = self._tlocal.commit
+
+        def run():
+            with pacherrors(path):
+                fn(commit)
+
+        ring.submit(run)
+
+    def _get_pool(self):
+        """Get the thread pool used to prefetch listings, creating it if needed."""
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=16)
+        return self._pool
+
+    def _list_async(self, path, namespaces=None):
+        """Start listing a directory on the thread pool.
+
+        Returns a future of a list of `Info` objects. The path must be
+        known to be a directory, it isn't checked.
+        """
+        _key = self._path_to_key(self.validatepath(path))
+        self.flush()
+
+        def list_dir():
+            with pacherrors(path):
+                return [
+                    Info(self._info_from_object(obj, namespaces))
+                    for obj in self.client.pfs.list_file(file=self._file_uri(_key))
+                    if not obj.file.path.endswith(_EMPTY_SUFFIX)
+                ]
+
+        return self._get_pool().submit(list_dir)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        super(PACHFS, self).close()
 
     def _info_from_object(self, pfs_obj: pfs.FileInfo, namespaces=None):
         """Make an info dict from a pfs FileInfo Object."""
-        obj = pfs_obj.to_pydict()
-        is_dir = True if obj["fileType"] == 2 else False
-        info = {"basic": {"name": basename(obj["file"]["path"]), "is_dir": is_dir}}
-        _type = int(ResourceType.directory if is_dir else ResourceType.file)
-        info["details"] = {
-            "modified": datetime_to_epoch(obj["committed"]),
-            "size": obj["sizeBytes"] if "sizeBytes" in obj else 0,
-            "type": _type,
+        is_dir = pfs_obj.file_type == pfs.FileType.DIR
+        return {
+            "basic": {
+                "name": basename(pfs_obj.file.path.rstrip(self.delimiter)),
+                "is_dir": is_dir,
+            },
+            "details": {
+                "modified": datetime_to_epoch(pfs_obj.committed),
+                "size": pfs_obj.size_bytes,
+                "type": _DIR_TYPE if is_dir else _FILE_TYPE,
+            },
         }
-        return info
 
-    def is_dir(self, path):
-        _path = self.validatepath(path)
-        try:
-            return self.getinfo(_path).is_dir
-        except errors.ResourceNotFound:
-            return False
+    def _probe(self, path, key):
+        """
+        Stat a repo key with a single list_file call.
 
-    def isfile(self, path):
-        _path = self.validatepath(path)
+        Returns a tuple of ``(exists, is_dir, is_empty)``. A directory
+        holding only its own ``.empty`` marker counts as empty. The
+        listing is closed as soon as the answer is known, which cancels
+        the rest of the stream.
+
+        """
+        self.flush()
+        _key = key.strip(self.delimiter)
+        marker = "/{}{}".format(_key, _EMPTY_SUFFIX) if _key else _EMPTY_SUFFIX
         try:
-            return not self.getinfo(_path).is_dir
+            with pacherrors(path):
+                listing = self.client.pfs.list_file(file=self._file_uri(_key))
+                try:
+                    first = next(listing, None)
+                    if first is None:
+                        return (not _key, not _key, not _key)
+                    if (
+                        first.file_type == pfs.FileType.FILE
+                        and first.file.path.strip("/") == _key
+                    ):
+                        return (True, False, False)
+                    is_empty = all(
+                        info.file.path == marker
+                        for info in itertools.chain([first], listing)
+                    )
+                    return (True, True, is_empty)
+                finally:
+                    listing.close()
         except errors.ResourceNotFound:
-            return False
+            return (False, False, False)
 
-    def getinfo(self, path, namespaces=None):
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-        dir_path = dirname(_path)
-        if dir_path != "/":
-            with pacherrors(path):
-                file_obj = pfs.File.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}:{_path}"
-                )
-                obj = self.client.pfs.list_file(file=file_obj)
-                if len(list(obj)) == 0:
-                    raise errors.ResourceNotFound(path)
+    @_prep
+    def is_dir(self, path, _path, _key):
+        return self._probe(path, _key)[1]
 
-        if _path == "/":
-            return Info(
-                {
-                    "basic": {"name": "/", "is_dir": True},
-                    "details": {"type": int(ResourceType.directory)},
-                }
-            )
+    isdir = is_dir
 
-        obj = self._get_object(_path, _key)
-        for file in obj:
-            file_obj = file.to_pydict()
-            if file_obj["file"]["path"] == _path:
-                info = self._info_from_object(file, _key)
-                return Info(info)
-            else:
-                return Info(
-                    {
-                        "basic": {"name": _key, "is_dir": True},
-                        "details": {"type": int(ResourceType.directory)},
-                    }
-                )
+    @_prep
+    def isfile(self, path, _path, _key):
+        exists, is_dir, _ = self._probe(path, _key)
+        return exists and not is_dir
 
-    def _getinfo(self, path, namespaces=None):
-        """Gets info without checking for parent dir."""
-        namespaces = namespaces or ()
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
+    @_prep
+    def getinfo(self, path, _path, _key, namespaces=None):
         if _path == "/":
             return Info(
                 {
-                    "basic": {"name": "", "is_dir": True},
-                    "details": {"type": int(ResourceType.directory)},
+                    "basic": {"name": "/", "is_dir": True},
+                    "details": {"type": _DIR_TYPE},
                 }
             )
 
-        obj = self._get_object(path, _key)
-        if len(list(obj)) == 0:
-            raise errors.ResourceNotFound(path)
-        for file in obj:
-            if file.to_pydict()["file"]["path"] == path:
-                info = self._info_from_object(file)
-                return Info(info)
-            else:
-                return Info(
-                    {
-                        "basic": {"name": _key, "is_dir": True},
-                        "details": {"type": int(ResourceType.directory)},
-                    }
-                )
+        self.flush()
+        with pacherrors(path):
+            file_info = self.client.pfs.inspect_file(file=self._file_uri(_key))
+        return Info(self._info_from_object(file_info, namespaces))
 
     def listdir(self, path):
         _path = self.validatepath(path)
+        _key = self._path_to_key(_path)
+        self.flush()
         with pacherrors(path):
-            dir_list = self.client.pfs.list_file(
-                file=pfs.File.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}:{_path}"
-                )
-            )
+            dir_list = self.client.pfs.list_file(file=self._file_uri(_key))
             _directory = []
             for result in dir_list:
-                file_info = result.to_pydict()
-                # if file_info["file"]["path"] == f"{_path}/.empty":
-                #    continue
-                _directory.append(
-                    basename(file_info["file"]["path"].rstrip(self.delimiter))
-                )
+                if result.file.path.endswith(_EMPTY_SUFFIX):
+                    continue
+                _directory.append(basename(result.file.path.rstrip(self.delimiter)))
 
         if not _directory:
             if not self.getinfo(_path).is_dir:
                 raise errors.DirectoryExpected(path)
         return _directory
 
-    def makedir(self, path):
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_dir_key(_path)
+    @_prep
+    def makedir(self, path, _path, _key, permissions=None, recreate=False):
         if not self.isdir(dirname(_path)):
             raise errors.ResourceNotFound(path)
 
-        try:
-            self._getinfo(path)
-        except errors.ResourceNotFound:
-            pass
-        else:
+        exists, is_dir, _ = self._probe(path, _key)
+        if exists:
+            if recreate and is_dir:
+                return SubFS(self, path)
             raise errors.DirectoryExists(path)
+        keypath = _key + _EMPTY_SUFFIX
         with pacherrors(path):
-            with self.client.pfs.commit(
-                branch=pfs.Branch.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}"
+            self._with_commit(
+                lambda c: self.client.pfs.put_file_from_bytes(
+                    commit=c, path=keypath, data=b""
                 )
-            ) as c:
-                keypath = f"{_key}/.empty"
-                self.client.pfs.put_file_from_bytes(commit=c, path=keypath, data=b"")
+            )
         return SubFS(self, path)
 
-    def openbin(self, path, mode="r", buffering=-1, **options):
+    @_prep
+    def openbin(self, path, _path, _key, mode="r", buffering=-1, **options):
         _mode = Mode(mode)
         _mode.validate_bin()
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
+        self.flush()
 
         if _mode.create:
 
             def on_close_create(pach_file):
                 """Called when the pach file closes, to upload data."""
-                try:
-                    pach_file.raw.seek(0)
-                    with pacherrors(path):
-                        with self.client.pfs.commit(
-                            branch=pfs.Branch.from_uri(
-                                f"{self.project_name}/{self._repo_name}@{self.branch}"
-                            )
-                        ) as c:
-                            self.client.pfs.put_file_from_file(
-                                commit=c, path=_key, file=pach_file.raw
-                            )
-                finally:
-                    pach_file.raw.close()
+
+                def upload(c):
+                    try:
+                        self.client.pfs.put_file_from_file(
+                            commit=c, path=_key, file=pach_file.raw
+                        )
+                    finally:
+                        pach_file.raw.close()
+
+                pach_file.raw.seek(0)
+                self._submit(path, upload)
 
             try:
                 dir_path = dirname(_path)
@@ -510,151 +881,164 @@ class PACHFS(FS):
             pach_file = PachFile.factory(path, _mode, on_close=on_close_create)
             return pach_file
 
+        if not _mode.writing:
+            with pacherrors(path):
+                file_info = self.client.pfs.inspect_file(file=self._file_uri(_key))
+            if file_info.file_type == pfs.FileType.DIR:
+                raise errors.FileExpected(path)
+            reader = _LazyPachReader(
+                path,
+                lambda: self.client.pfs.get_file(file=file_info.file),
+                file_info.size_bytes,
+            )
+            return io.BufferedReader(reader, buffer_size=_BUFFER_SIZE)
+
         def on_close(pach_file):
             """Called when the PACH file closes, to upload the data."""
-            try:
-                if _mode.writing:
-                    pach_file.raw.seek(0, os.SEEK_SET)
-                    with pacherrors(path):
-                        with self.client.pfs.commit(
-                            branch=pfs.Branch.from_uri(
-                                f"{self.project_name}/{self._repo_name}@{self.branch}"
-                            )
-                        ) as c:
-                            self.client.pfs.put_file_from_file(
-                                commit=c, path=_key, file=pach_file
-                            )
-            finally:
-                pach_file.raw.close()
+
+            def upload(c):
+                try:
+                    self.client.pfs.put_file_from_file(
+                        commit=c, path=_key, file=pach_file.raw
+                    )
+                finally:
+                    pach_file.raw.close()
+
+            pach_file.raw.seek(0, os.SEEK_SET)
+            self._submit(path, upload)
 
         pach_file = PachFile.factory(path, _mode, on_close=on_close)
         with pacherrors(path):
-            fileobj = pfs.File.from_uri(
-                f"{self.project_name}/{self._repo_name}@{self.branch}:{_key}"
-            )
-            bytestream = self.client.pfs.pfs_file(file=fileobj)
-            for byte in bytestream:
-                pach_file.write(byte)
+            fileobj = self._file_uri(_key)
+            bytestream = self.client.pfs.get_file(file=fileobj)
+            pach_file.raw.writelines(_iter_bytes(bytestream))
         pach_file.seek(0, os.SEEK_SET)
         return pach_file
 
-    def remove(self, path):
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-        with self.client.pfs.commit(
-            branch=pfs.Branch.from_uri(
-                f"{self.project_name}/{self._repo_name}@{self.branch}"
+    @_prep
+    def remove(self, path, _path, _key):
+        with pacherrors(path):
+            self._with_commit(
+                lambda c: self.client.pfs.delete_file(commit=c, path=_key)
             )
-        ) as c:
-            self.client.pfs.delete_file(commit=c, path=_key)
 
-    def isempty(self, path):
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_dir_key(_path)
-        pfs_file = pfs.File.from_uri(
-            f"{self.project_name}/{self._repo_name}@{self.branch}:{_key}"
-        )
-        contents = self.client.pfs.list_file(file=pfs_file)
-        for obj in contents:
-            if obj["Key"] != _key and obj["Key"] != ".empty":
-                return False
-        return True
+    @_prep
+    def isempty(self, path, _path, _key):
+        exists, _, is_empty = self._probe(path, _key)
+        if not exists:
+            raise errors.ResourceNotFound(path)
+        return is_empty
 
     def setinfo(self, path, info):
         self.getinfo(path)
 
-    def readbytes(self, path):
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-        bytes_file = io.BytesIO()
-        with pacherrors(path):
-            fileobj = pfs.File.from_uri(
-                f"{self.project_name}/{self._repo_name}@{self.branch}:{_key}"
-            )
-            bytestream = self.client.pfs.pfs_file(file=fileobj)
-            for byte in bytestream:
-                bytes_file.write(byte.value)
-        return bytes_file.getvalue()
+    @_prep
+    def readbytes(self, path, _path, _key):
+        return b"".join(self._read_chunks(path, _key))
 
-    def download(self, path, file, **options):
-        self.check()
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-        print(f"path: {_path}, file: {file}")
+    @_prep
+    def download(self, path, _path, _key, file, **options):
+        file.writelines(self._read_chunks(path, _key))
+
+    def _read_chunks(self, path, key):
+        """
+        Yield the contents of a file in order.
+
+        Files of at least ``_PARALLEL_READ_SIZE`` bytes are read as ranges
+        on the thread pool, ``_RANGE_WORKERS`` at a time, so several
+        ``get_file`` calls are in flight at once. All reads are pinned to
+        the commit the file was inspected at.
+
+        The ranges share the client's single gRPC channel, so they are
+        multiplexed over one HTTP/2 connection rather than separate TCP
+        flows. ``get_file`` takes no end offset either, so each range is
+        streamed towards the end of the file until it is cancelled, and
+        may over-fetch up to one flow-control window.
+
+        """
+        self.flush()
         with pacherrors(path):
-            src_file = self.client.pfs.pfs_file(
-                file=pfs.File.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}:{_key}"
-                )
+            file_info = self.client.pfs.inspect_file(file=self._file_uri(key))
+        if file_info.file_type == pfs.FileType.DIR:
+            raise errors.FileExpected(path)
+        size = file_info.size_bytes
+        if size < _PARALLEL_READ_SIZE:
+            with pacherrors(path):
+                bytestream = self.client.pfs.get_file(file=file_info.file)
+                for chunk in _iter_bytes(bytestream):
+                    yield chunk
+            return
+
+        pool = self._get_pool()
+        offsets = iter(range(0, size, _RANGE_SIZE))
+
+        def submit(offset):
+            return pool.submit(
+                self._read_range, path, file_info.file, offset, _RANGE_SIZE
             )
-            shutil.copyfileobj(src_file, file)
 
-    def exists(self, path):
-        self.check()
-        _path = self.validatepath(path)
-        if _path == "/":
-            return True
-        _key = self._path_to_dir_key(_path)
+        pending = collections.deque(
+            map(submit, itertools.islice(offsets, _RANGE_WORKERS))
+        )
         try:
-            self._get_object(path, _key)
-        except errors.ResourceNotFound:
-            return False
-        else:
-            return True
+            while pending:
+                data = pending.popleft().result()
+                pending.extend(map(submit, itertools.islice(offsets, 1)))
+                yield data
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _read_range(self, path, file, offset, size):
+        """Read up to ``size`` bytes of a pfs.File starting at ``offset``."""
+        data = bytearray()
+        with pacherrors(path):
+            bytestream = self.client.pfs.get_file(file=file, offset=offset)
+            try:
+                for chunk in _iter_bytes(bytestream):
+                    data += chunk
+                    if len(data) >= size:
+                        break
+            finally:
+                bytestream.close()
+        return bytes(data[:size])
+
+    @_prep
+    def exists(self, path, _path, _key):
+        return self._probe(path, _key)[0]
 
     def scandir(self, path, namespaces=None, page=None):
         namespaces = namespaces or ()
         info = self.getinfo(path)
         if not info.is_dir:
             raise errors.DirectoryExpected(path)
+        _key = self._path_to_key(self.validatepath(path))
+        info_from_object = self._info_from_object
         with pacherrors(path):
-            dir_list = self.client.pfs.list_file(
-                file=pfs.File.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}:{path}"
-                )
-            )
-
-        def gen_info():
-            for obj in dir_list:
-                file_obj = self._info_from_object(obj, namespaces)
-                yield Info(file_obj)
-
-        iter_info = iter(gen_info())
+            for obj in self.client.pfs.list_file(file=self._file_uri(_key)):
+                if obj.file.path.endswith(_EMPTY_SUFFIX):
+                    continue
+                yield Info(info_from_object(obj, namespaces))
 
-        for info in iter_info:
-            yield info
-
-    def writebytes(self, path, contents):
+    @_prep
+    def writebytes(self, path, _path, _key, contents):
         if not isinstance(contents, bytes):
             raise TypeError("contents must be bytes")
+        self._submit(
+            path,
+            lambda c: self.client.pfs.put_file_from_bytes(
+                commit=c, path=_key, data=contents
+            ),
+        )
 
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-        bytes_file = io.BytesIO(contents)
-        with pacherrors(path):
-            with self.client.pfs.commit(
-                branch=pfs.Branch.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}"
-                )
-            ) as c:
-                self.client.pfs.put_file_from_bytes(
-                    commit=c, path=_key, data=bytes_file
-                )
-
-    def upload(self, path, file, chunk_size=None, **options):
-        _path = self.validatepath(path)
-        _key = self._path_to_key(_path)
-
+    @_prep
+    def upload(self, path, _path, _key, file, chunk_size=None, **options):
         with pacherrors(path):
-            with self.client.pfs.commit(
-                branch=pfs.Branch.from_uri(
-                    f"{self.project_name}/{self._repo_name}@{self.branch}"
+            self._with_commit(
+                lambda c: self.client.pfs.put_file_from_file(
+                    commit=c, path=_key, file=file
                 )
-            ) as c:
-                self.client.pfs.put_file_from_file(commit=c, path=_key, file=file)
+            )
 
     def copy(self, src_path, dst_path, overwrite=False):
         if not overwrite and self.exists(dst_path):
@@ -665,31 +1049,53 @@ class PACHFS(FS):
         _dst_key = self._path_to_key(_dst_path)
         try:
             with pacherrors(src_path):
-                with self.client.pfs.commit(
-                    branch=pfs.Branch.from_uri(
-                        f"{self.project_name}/{self._repo_name}@{self.branch}"
+                src_file = self._file_uri(_src_key)
+                self._with_commit(
+                    lambda c: self.client.pfs.copy_file(
+                        commit=c, src=src_file, dst=_dst_key
                     )
-                ) as c:
-                    src_file = pfs.File.from_uri(
-                        f"{self.project_name}/{self._repo_name}@{self.branch}/{_src_key}"
-                    )
-                    self.client.pfs.copy_file(commit=c, src=src_file, dst=_dst_key)
+                )
         except errors.ResourceNotFound:
             if self.exists(src_path):
                 raise errors.FileExpected(src_path)
             raise
 
+    def copy_many(self, pairs, overwrite=False):
+        """
+        Copy several files within the repo using a single commit.
+
+        :param pairs: An iterable of ``(src_path, dst_path)`` tuples.
+        :param bool overwrite: If `True`, overwrite existing destinations,
+            otherwise raise `~fs.errors.DestinationExists` before anything
+            is copied.
+
+        """
+        pairs = list(pairs)
+        if not overwrite:
+            for _, dst_path in pairs:
+                if self.exists(dst_path):
+                    raise errors.DestinationExists(dst_path)
+        with self.batch():
+            for src_path, dst_path in pairs:
+                self.copy(src_path, dst_path, overwrite=True)
+
     def move(self, src_path, dst_path, overwrite=False):
         self.copy(src_path, dst_path, overwrite=overwrite)
         self.remove(src_path)
 
-    def removedir(self, path):
-        self.check()
-        _path = self.validatepath(path)
+    @_prep
+    def removedir(self, path, _path, _key):
         if _path == "/":
             raise errors.RemoveRootError()
-        info = self.getinfo(_path)
-        if not info.is_dir:
+        exists, is_dir, is_empty = self._probe(path, _key)
+        if not exists:
+            raise errors.ResourceNotFound(path)
+        if not is_dir:
             raise errors.DirectoryExpected(path)
-        if not self.isempty(path):
+        if not is_empty:
             raise errors.DirectoryNotEmpty(path)
+        _dir_key = self._path_to_dir_key(_path)
+        with pacherrors(path):
+            self._with_commit(
+                lambda c: self.client.pfs.delete_file(commit=c, path=_dir_key)
+            )
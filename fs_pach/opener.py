@@ -1,8 +1,6 @@
 # coding: utf-8
 """Defines the PACHFS Opener."""
 
-from __future__ import absolute_import, print_function, unicode_literals
-
 __all__ = ["PACHFSOpener"]
 
 from fs.opener import Opener
@@ -12,6 +10,18 @@ from ._pachfs import PACHFS
 
 
 class PACHFSOpener(Opener):
+    """
+    Open a PACHFS from a ``pach://project/repo@branch:/dir`` URL.
+
+    Every write to the returned filesystem is its own Pachyderm commit.
+    Wrap bulk operations in :meth:`PACHFS.batch` to share one commit::
+
+        pachfs = open_fs("pach://default/test@master:/")
+        with pachfs.batch():
+            copy_fs(src_fs, pachfs)
+
+    """
+
     protocols = ["pach"]
 
     def open_fs(self, fs_url, parse_result, writeable, create, cwd):
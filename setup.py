@@ -21,7 +21,7 @@ CLASSIFIERS = [
 with open("README.rst", "rt") as f:
     DESCRIPTION = f.read()
 
-REQUIREMENTS = ["pachyderm-sdk>=2.0.0", "fs~=2.4", "six~=1.10"]
+REQUIREMENTS = ["pachyderm-sdk>=2.0.0", "fs~=2.4"]
 
 setup(
     name="fs-pach",
@@ -0,0 +1,141 @@
+"""In-memory stand-in for the Pachyderm PFS client used by the tests."""
+
+import contextlib
+import datetime
+import posixpath
+
+import grpc
+from betterproto.lib.google.protobuf import BytesValue
+from pachyderm_sdk.api import pfs
+
+
+class NotFound(grpc.RpcError, grpc.Call):
+    def code(self):
+        return grpc.StatusCode.NOT_FOUND
+
+    def details(self):
+        return "not found"
+
+    def initial_metadata(self):
+        pass
+
+    def trailing_metadata(self):
+        pass
+
+    def is_active(self):
+        return False
+
+    def time_remaining(self):
+        pass
+
+    def cancel(self):
+        pass
+
+    def add_callback(self, callback):
+        pass
+
+
+def _norm(path):
+    return posixpath.normpath("/" + path.lstrip("/"))
+
+
+class FakePFS:
+    """Files live in a dict; reads of the branch see its open commit.
+
+    Every write replaces ``files`` with a new dict, and ``inspect_file``
+    pins the returned file to the dict it saw.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.snapshots = {}
+        self.commits = 0
+        self.calls = []
+
+    @contextlib.contextmanager
+    def commit(self, branch=None):
+        self.commits += 1
+        yield pfs.Commit(id="c%d" % self.commits)
+
+    def _write(self, path, data):
+        self.files = dict(self.files)
+        self.files[_norm(path)] = data
+
+    def put_file_from_file(self, commit, path, file, append=False):
+        self.calls.append(("put", path))
+        self._write(path, file.read())
+
+    def put_file_from_bytes(self, commit, path, data, append=False):
+        self.calls.append(("put", path))
+        self._write(path, bytes(data))
+
+    def delete_file(self, commit, path):
+        self.calls.append(("delete", path))
+        path = _norm(path)
+        self.files = {
+            key: data
+            for key, data in self.files.items()
+            if key != path and not key.startswith(path.rstrip("/") + "/")
+        }
+
+    def copy_file(self, commit, src, dst, append=False):
+        if _norm(src.path) not in self.files:
+            raise NotFound()
+        self._write(dst, self.files[_norm(src.path)])
+
+    def _dirs(self):
+        dirs = {"/"}
+        for key in self.files:
+            parts = key.split("/")[1:-1]
+            for i in range(1, len(parts) + 1):
+                dirs.add("/" + "/".join(parts[:i]))
+        return dirs
+
+    def _info(self, path, is_dir):
+        return pfs.FileInfo(
+            file=pfs.File(path=path + ("/" if is_dir else "")),
+            file_type=pfs.FileType.DIR if is_dir else pfs.FileType.FILE,
+            committed=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+            size_bytes=0 if is_dir else len(self.files[path]),
+        )
+
+    def inspect_file(self, file):
+        path = _norm(file.path)
+        if path in self.files:
+            info = self._info(path, False)
+            info.file.commit = pfs.Commit(id="s%d" % len(self.snapshots))
+            self.snapshots[info.file.commit.id] = self.files
+            return info
+        if path in self._dirs():
+            return self._info(path, True)
+        raise NotFound()
+
+    def list_file(self, file):
+        path = _norm(file.path)
+        if path in self.files:
+            yield self._info(path, False)
+            return
+        base = path.rstrip("/") + "/"
+        seen = set()
+        for key in sorted(self.files):
+            if key.startswith(base):
+                name = key[len(base) :].split("/")[0]
+                if name not in seen:
+                    seen.add(name)
+                    full = base + name
+                    yield self._info(full, full not in self.files)
+
+    def get_file(self, file, offset=0):
+        path = _norm(file.path)
+        self.calls.append(("get", path, offset))
+        files = self.snapshots.get(file.commit.id, self.files)
+        if path not in files:
+            raise NotFound()
+        data = files[path][offset:]
+        for i in range(0, len(data), 3):
+            yield BytesValue(value=data[i : i + 3])
+
+
+class FakeClient:
+    def __init__(self):
+        self.pfs = FakePFS()
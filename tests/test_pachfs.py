@@ -0,0 +1,363 @@
+import io
+import os
+import threading
+import unittest
+from unittest import mock
+
+from fs import errors
+from fs.copy import copy_fs
+from fs.memoryfs import MemoryFS
+from fs.walk import Walker
+
+from fs_pach import _pachfs
+from fs_pach._pachfs import PACHFS, PachWalker, _UploadRing
+from fakepfs import FakeClient, NotFound
+
+
+class TestUploadRing(unittest.TestCase):
+    def test_runs_in_order(self):
+        ring = _UploadRing()
+        done = []
+        for i in range(20):
+            ring.submit(lambda i=i: done.append(i))
+        ring.close()
+        self.assertEqual(done, list(range(20)))
+
+    def test_join_raises_first_error(self):
+        ring = _UploadRing()
+        done = []
+
+        def fail(message):
+            raise ValueError(message)
+
+        ring.submit(lambda: fail("first"))
+        ring.submit(lambda: fail("second"))
+        ring.submit(lambda: done.append(1))
+        with self.assertRaisesRegex(ValueError, "first"):
+            ring.join()
+        self.assertEqual(done, [1])
+        ring.close()
+
+    def test_close_can_log_error(self):
+        ring = _UploadRing()
+        ring.submit(lambda: 1 / 0)
+        with self.assertLogs("fs_pach._pachfs", "ERROR"):
+            ring.close(raise_error=False)
+
+
+class PachTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        patcher = mock.patch.object(PACHFS, "client", property(lambda fs: self.client))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fs = PACHFS("repo")
+        self.addCleanup(self.fs.close)
+
+
+class TestBatch(PachTestCase):
+    def test_one_shot_write_has_no_ring(self):
+        threads = threading.active_count()
+        self.fs.writebytes("a.txt", b"a")
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(self.client.pfs.files["/a.txt"], b"a")
+
+    def test_single_commit(self):
+        with self.fs.batch():
+            for i in range(5):
+                self.fs.writebytes("f%d" % i, b"x")
+        self.assertEqual(self.client.pfs.commits, 1)
+        self.assertEqual(len(self.client.pfs.files), 5)
+
+    def test_uploads_keep_order(self):
+        with self.fs.batch():
+            for i in range(10):
+                self.fs.writebytes("f.txt", b"%d" % i)
+        self.assertEqual(self.client.pfs.files["/f.txt"], b"9")
+
+    def test_reads_see_queued_writes(self):
+        with self.fs.batch():
+            self.fs.makedir("a")
+            self.fs.makedir("a/b")
+            self.fs.writebytes("a/b/c.txt", b"c")
+            self.assertTrue(self.fs.exists("a/b/c.txt"))
+            self.assertEqual(self.fs.listdir("a/b"), ["c.txt"])
+            self.assertEqual(self.fs.readbytes("a/b/c.txt"), b"c")
+            with self.fs.openbin("a/b/c.txt") as f:
+                self.assertEqual(f.read(), b"c")
+
+    def test_write_after_close(self):
+        with self.fs.batch():
+            f = self.fs.openbin("a.txt", "w")
+            f.write(b"abc")
+            f.close()
+            self.assertTrue(f.closed)
+            with self.assertRaises(ValueError):
+                f.write(b"MORE")
+            with self.assertRaises(ValueError):
+                f.seek(0)
+        self.assertEqual(self.client.pfs.files["/a.txt"], b"abc")
+
+    def test_copy_fs(self):
+        src = MemoryFS()
+        src.makedirs("a/b")
+        src.makedir("empty")
+        src.writebytes("a/b/c.txt", b"c")
+        src.writebytes("top.txt", b"top")
+        with self.fs.batch():
+            copy_fs(src, self.fs)
+        self.assertEqual(self.client.pfs.commits, 1)
+        self.assertEqual(self.fs.readbytes("a/b/c.txt"), b"c")
+        self.assertEqual(self.fs.readbytes("top.txt"), b"top")
+        self.assertTrue(self.fs.isdir("empty"))
+
+    def test_upload_error_raised(self):
+        with mock.patch.object(
+            self.client.pfs, "put_file_from_bytes", side_effect=OSError("boom")
+        ):
+            with self.assertRaises(errors.RemoteConnectionError):
+                with self.fs.batch():
+                    self.fs.writebytes("a.txt", b"a")
+
+    def test_body_error_not_masked(self):
+        with mock.patch.object(
+            self.client.pfs, "put_file_from_bytes", side_effect=OSError("boom")
+        ):
+            with self.assertLogs("fs_pach._pachfs", "ERROR"):
+                with self.assertRaises(KeyError):
+                    with self.fs.batch():
+                        self.fs.writebytes("a.txt", b"a")
+                        raise KeyError("body")
+
+
+class TestLazyReader(PachTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fs.writebytes("f.txt", b"0123456789")
+
+    def gets(self):
+        return [call for call in self.client.pfs.calls if call[0] == "get"]
+
+    def test_forward_seek(self):
+        with self.fs.openbin("f.txt") as f:
+            self.assertEqual(f.read(2), b"01")
+            self.assertEqual(f.seek(7), 7)
+            self.assertEqual(f.read(), b"789")
+        self.assertEqual(len(self.gets()), 1)
+
+    def test_backward_seek(self):
+        with self.fs.openbin("f.txt") as f:
+            self.assertEqual(f.read(8), b"01234567")
+            self.assertEqual(f.seek(-5, os.SEEK_CUR), 3)
+            self.assertEqual(f.read(3), b"345")
+            self.assertEqual(f.seek(1), 1)
+            self.assertEqual(f.read(1), b"1")
+
+    def test_end_seek(self):
+        with self.fs.openbin("f.txt") as f:
+            self.assertEqual(f.seek(-4, os.SEEK_END), 6)
+            self.assertEqual(f.read(), b"6789")
+            self.assertEqual(f.seek(0, os.SEEK_END), 10)
+            self.assertEqual(f.read(), b"")
+        self.assertEqual(len(self.gets()), 1)
+
+    def test_pinned_to_commit(self):
+        with self.fs.openbin("f.txt") as f:
+            self.assertEqual(f.read(8), b"01234567")
+            self.fs.writebytes("f.txt", b"abcdefghij")
+            f.seek(0)
+            self.assertEqual(f.read(), b"0123456789")
+        self.assertEqual(self.fs.readbytes("f.txt"), b"abcdefghij")
+
+    def test_close_ends_stream(self):
+        with self.fs.openbin("f.txt") as f:
+            self.assertEqual(f.read(1), b"0")
+            stream = f.raw._stream
+        self.assertIsNone(f.raw._stream)
+        with self.assertRaises(StopIteration):
+            next(stream)
+
+    def test_missing(self):
+        with self.assertRaises(errors.ResourceNotFound):
+            self.fs.openbin("nope.txt")
+
+    def test_directory(self):
+        self.fs.makedir("d")
+        with self.assertRaises(errors.FileExpected):
+            self.fs.openbin("d")
+
+
+class TestRangeReads(PachTestCase):
+    data = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        for name, value in (("_PARALLEL_READ_SIZE", 100), ("_RANGE_SIZE", 64)):
+            patcher = mock.patch.object(_pachfs, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.fs.writebytes("big.bin", self.data)
+        self.fs.writebytes("small.bin", self.data[:50])
+
+    def offsets(self, path):
+        return sorted(
+            call[2]
+            for call in self.client.pfs.calls
+            if call[0] == "get" and call[1] == path
+        )
+
+    def test_readbytes(self):
+        self.assertEqual(self.fs.readbytes("big.bin"), self.data)
+        self.assertEqual(self.offsets("/big.bin"), list(range(0, 1024, 64)))
+
+    def test_download(self):
+        out = io.BytesIO()
+        self.fs.download("big.bin", out)
+        self.assertEqual(out.getvalue(), self.data)
+        self.assertEqual(self.offsets("/big.bin"), list(range(0, 1024, 64)))
+
+    def test_small_file(self):
+        self.assertEqual(self.fs.readbytes("small.bin"), self.data[:50])
+        self.assertEqual(self.offsets("/small.bin"), [0])
+
+    def test_early_exit(self):
+        chunks = self.fs._read_chunks("big.bin", "big.bin")
+        self.assertEqual(next(chunks), self.data[:64])
+        chunks.close()
+        self.assertLessEqual(len(self.offsets("/big.bin")), 1 + _pachfs._RANGE_WORKERS)
+
+
+class TestWalk(PachTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fs.makedirs("a/b/c")
+        self.fs.makedir("e")
+        for path in ("top.txt", "a/1.txt", "a/b/2.txt", "a/b/c/3.txt"):
+            self.fs.writebytes(path, path.encode())
+
+    def steps(self, walker):
+        return [
+            (path, [d.name for d in dirs], [f.name for f in files])
+            for path, dirs, files in walker.walk(self.fs)
+        ]
+
+    def test_matches_walker(self):
+        self.assertIs(self.fs.walker_class, PachWalker)
+        for search in ("breadth", "depth"):
+            for max_depth in (None, 1, 2):
+                self.assertEqual(
+                    self.steps(PachWalker(search=search, max_depth=max_depth)),
+                    self.steps(Walker(search=search, max_depth=max_depth)),
+                )
+
+    def test_prefetch(self):
+        with mock.patch.object(self.fs, "scandir", wraps=self.fs.scandir) as scandir:
+            steps = self.steps(PachWalker())
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(
+            steps,
+            [
+                ("/", ["a", "e"], ["top.txt"]),
+                ("/a", ["b"], ["1.txt"]),
+                ("/e", [], []),
+                ("/a/b", ["c"], ["2.txt"]),
+                ("/a/b/c", [], ["3.txt"]),
+            ],
+        )
+
+    def test_max_depth_scans(self):
+        with mock.patch.object(self.fs, "_list_async") as list_async:
+            self.steps(PachWalker(max_depth=2))
+        list_async.assert_not_called()
+
+    def test_prefetch_error(self):
+        list_file = self.client.pfs.list_file
+
+        def failing(file):
+            if file.path.strip("/") == "a/b":
+                raise NotFound()
+            return list_file(file)
+
+        self.client.pfs.list_file = failing
+        failed = []
+
+        def on_error(path, error):
+            failed.append((path, type(error)))
+            return True
+
+        steps = self.steps(PachWalker(on_error=on_error))
+        self.assertEqual(failed, [("/a/b", errors.ResourceNotFound)])
+        self.assertEqual(steps, self.steps(Walker(on_error=lambda *args: True)))
+        self.assertEqual(steps[-1], ("/a/b", [], []))
+        with self.assertRaises(errors.ResourceNotFound):
+            self.steps(PachWalker())
+
+
+class TestCopyMany(PachTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ("a", "b", "c"):
+            self.fs.writebytes(name, name.encode())
+        self.commits = self.client.pfs.commits
+
+    def test_one_commit(self):
+        self.fs.copy_many([("a", "a2"), ("b", "b2"), ("c", "c2")])
+        self.assertEqual(self.client.pfs.commits, self.commits + 1)
+        for name in ("a", "b", "c"):
+            self.assertEqual(self.fs.readbytes(name + "2"), name.encode())
+
+    def test_destination_exists(self):
+        with self.assertRaises(errors.DestinationExists):
+            self.fs.copy_many([("a", "a2"), ("b", "c")])
+        self.assertEqual(self.client.pfs.commits, self.commits)
+        self.assertFalse(self.fs.exists("a2"))
+
+    def test_overwrite(self):
+        self.fs.copy_many([("a", "b")], overwrite=True)
+        self.assertEqual(self.fs.readbytes("b"), b"a")
+
+    def test_missing_source(self):
+        with self.assertRaises(errors.ResourceNotFound):
+            self.fs.copy_many([("nope", "a2")])
+
+
+class TestMakedir(PachTestCase):
+    def test_recreate(self):
+        self.fs.makedir("a")
+        with self.assertRaises(errors.DirectoryExists):
+            self.fs.makedir("a")
+        self.fs.makedir("a", recreate=True)
+        self.fs.makedirs("a/b/c", recreate=True)
+        self.assertTrue(self.fs.isdir("a/b/c"))
+
+    def test_marker_hidden(self):
+        self.fs.makedir("a")
+        self.fs.makedir("a/b")
+        self.assertIn("/a/b/.empty", self.client.pfs.files)
+        self.assertEqual(self.fs.listdir("a"), ["b"])
+        self.assertEqual(self.fs.listdir("a/b"), [])
+        self.assertEqual([info.name for info in self.fs.scandir("a/b")], [])
+
+    def test_recreate_file(self):
+        self.fs.writebytes("f", b"")
+        with self.assertRaises(errors.DirectoryExists):
+            self.fs.makedir("f", recreate=True)
+
+
+class TestProbe(PachTestCase):
+    def test_empty_dir(self):
+        self.assertTrue(self.fs.isempty("/"))
+        self.fs.makedir("a")
+        self.assertTrue(self.fs.isdir("a"))
+        self.assertTrue(self.fs.isempty("a"))
+        self.assertFalse(self.fs.isempty("/"))
+
+    def test_missing(self):
+        self.assertFalse(self.fs.exists("nope"))
+        self.assertFalse(self.fs.isdir("nope"))
+        with self.assertRaises(errors.ResourceNotFound):
+            self.fs.isempty("nope")
+
+
+if __name__ == "__main__":
+    unittest.main()